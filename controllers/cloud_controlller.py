@@ -1,7 +1,9 @@
 import os
 import io
+import asyncio
 import tempfile
-from typing import Dict, Any, List
+import aiofiles
+from typing import Dict, Any, List, Optional
 from fastapi import UploadFile, File, HTTPException, status, Form, Query # Import Query for optional params
 from appwrite.id import ID
 from appwrite.input_file import InputFile
@@ -9,12 +11,28 @@ from appwrite.permission import Permission
 from appwrite.role import Role
 from appwrite.query import Query as AppwriteQuery # Alias to avoid conflict with FastAPI's Query
 from appwrite.exception import AppwriteException
-from core.cloud.appwrite import cloud_storage, cloud_database
+from core.cloud.appwrite import cloud_storage, cloud_database, appwrite_http, filename_cache, owner_permissions, file_document
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import httpx
+from cachetools import TTLCache
 
 APPWRITE_BUCKET_ID = os.environ.get("APPWRITE_BUCKET_ID")
 APPWRITE_DATABASE_ID = os.environ.get("APPWRITE_DATABASE_ID")
-FILE_COLLECTION_ID = os.environ.get("FILE_COLLECTION_ID", "files") 
+FILE_COLLECTION_ID = os.environ.get("FILE_COLLECTION_ID", "files")
+
+# Chunk size for copying uploads to disk (1 MiB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Uploads smaller than this are handed to Appwrite straight from memory
+# (InputFile.from_bytes); larger ones are spilled to a temp file (10 MiB)
+UPLOAD_INLINE_THRESHOLD = 10 << 20
+
+# Short-lived cache for list/association query results so repeated page
+# loads within the TTL skip the Appwrite round-trip entirely.
+# Only touched from the event loop, so no extra locking is needed.
+_LIST_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=30)
 
 # 💡 CHANGE: Removed Depends, added user_id via Form
 async def upload_file_endpoint(
@@ -22,64 +40,68 @@ async def upload_file_endpoint(
     user_id: str = Form(...), # 👈 The user_id is now passed as form data
 ) -> Dict[str, Any]:
     
-    # 1. ⚙️ Pre-Flight Configuration Check (Remains the same)
-    missing_config = []
-    if not APPWRITE_BUCKET_ID:
-        missing_config.append("APPWRITE_BUCKET_ID")
-    if not APPWRITE_DATABASE_ID:
-        missing_config.append("APPWRITE_DATABASE_ID")
-    if not FILE_COLLECTION_ID:
-        missing_config.append("FILE_COLLECTION_ID")
-
-    if missing_config:
-        print(f"CRITICAL CONFIG ERROR: Missing variables: {', '.join(missing_config)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Server Configuration Error: The backend is missing the following Appwrite environment IDs: {', '.join(missing_config)}. Please check your .env file or deployment setup.",
-        )
-        
+    # Configuration is validated once at startup (see main.py lifespan),
+    # so no per-request pre-flight check is needed here.
     original_file_name = file.filename
     temp_input_path = None
     new_file_id = ID.unique()
 
     try:
-        # --- Save Uploaded File to Temporary Location ---
-        temp_input_path = f"{tempfile.gettempdir()}/{original_file_name}"
-        # We must use await file.read() here
-        content = await file.read() 
-        with open(temp_input_path, "wb") as tmp_file:
-            tmp_file.write(content)
-        
-        # --- Upload File to Appwrite Storage ---
-        file_wrapper = InputFile.from_path(path=temp_input_path)
-        
+        # --- Read the Upload: inline fast path vs. temp-file spill ---
+        # Most user uploads (images, small docs) fit comfortably in memory,
+        # so hand those to Appwrite via InputFile.from_bytes and skip the
+        # /tmp write+read+unlink cycle entirely. Only uploads past the
+        # threshold are spilled to a unique, race-free NamedTemporaryFile
+        # (the client-controlled filename never becomes a filesystem path),
+        # still copied in 1 MiB chunks so peak memory stays bounded.
+        buffered = bytearray()
+        while len(buffered) < UPLOAD_INLINE_THRESHOLD and (chunk := await file.read(UPLOAD_CHUNK_SIZE)):
+            buffered.extend(chunk)
+
+        if len(buffered) < UPLOAD_INLINE_THRESHOLD:
+            # Whole file fits in memory — no temp file needed
+            file_wrapper = InputFile.from_bytes(bytes(buffered), filename=original_file_name)
+        else:
+            # NamedTemporaryFile only reserves the race-free path; the
+            # actual writes go through aiofiles so a multi-MB spill
+            # doesn't block the event loop on disk I/O.
+            file_suffix = os.path.splitext(original_file_name)[1]
+            tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_suffix)
+            tmp_file.close()
+            temp_input_path = tmp_file.name
+            async with aiofiles.open(temp_input_path, "wb") as spill:
+                await spill.write(buffered)
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await spill.write(chunk)
+            file_wrapper = InputFile.from_path(path=temp_input_path)
+
+
         # 💡 CHANGE: Permissions still require the user_id for security
-        permissions_list = [
-            Permission.read(Role.user(user_id)), 
-            Permission.write(Role.user(user_id)),
-            Permission.update(Role.user(user_id)),
-            Permission.delete(Role.user(user_id)),
-        ]
-        
-        # Assuming synchronous call works for now
-        upload_result = cloud_storage.create_file(
+        permissions_list = owner_permissions(user_id)
+
+
+        # The Appwrite SDK is synchronous, so run it in the threadpool to
+        # avoid blocking the event loop for the whole network round-trip.
+        upload_result = await run_in_threadpool(
+            cloud_storage.create_file,
             bucket_id=APPWRITE_BUCKET_ID,
-            file_id=new_file_id, 
+            file_id=new_file_id,
             file=file_wrapper,
             permissions=permissions_list,
         )
 
         # --- Log Metadata to Appwrite Database (FOR LISTING) ---
-        doc_data = {
-            "user_id": user_id, # 👈 Use the passed user_id
-            "type": "original", 
-            "name": os.path.splitext(original_file_name)[0],
-            "file_id": new_file_id,
-            "source_file_id": new_file_id # The source is itself
-        }
+        doc_data = file_document(
+            user_id=user_id,
+            type="original",
+            name=os.path.splitext(original_file_name)[0],
+            file_id=new_file_id,
+            source_file_id=new_file_id # The source is itself
+        )
 
-        # Assuming synchronous call works for now
-        cloud_database.create_document(
+        # Synchronous SDK call offloaded to the threadpool as well
+        await run_in_threadpool(
+            cloud_database.create_document,
             database_id=APPWRITE_DATABASE_ID,
             collection_id=FILE_COLLECTION_ID,
             document_id=ID.unique(),
@@ -87,9 +109,18 @@ async def upload_file_endpoint(
             permissions=[Permission.read(Role.user(user_id))]
         )
         
+        # Remember the filename so later endpoints (e.g. the DOCX download)
+        # don't need a metadata round-trip just to learn the name.
+        filename_cache[new_file_id] = original_file_name
+
+        # --- Invalidate the cached listing for this user ---
+        # The new "original" file must show up on the next listing call
+        # (first page, i.e. no cursor).
+        _LIST_CACHE.pop(("list", user_id, "original", None), None)
+
         # --- Return Success ---
         return {
-            "success": True, 
+            "success": True,
             "message": "File uploaded successfully and ready for processing.",
             "file_id": new_file_id,
             "file_name": original_file_name
@@ -126,59 +157,75 @@ async def upload_file_endpoint(
 
 # 🚀 NEW ENDPOINT: files_listing_endpoint
 # This endpoint retrieves a list of the user's uploaded "original" files (Lessons).
+# Page size for the cursor-paginated listing
+LISTING_PAGE_SIZE = 50
+
 async def files_listing_endpoint(
     user_id: str = Query(..., description="The ID of the user whose files to retrieve."),
-    type: str = Query("original", description="The type of file to filter by (default: original).")
+    type: str = Query("original", description="The type of file to filter by (default: original)."),
+    after: Optional[str] = Query(None, description="Cursor: document_id of the last entry from the previous page.")
 ) -> Dict[str, Any]:
-    
-    # 1. ⚙️ Pre-Flight Configuration Check
-    missing_config = []
-    if not APPWRITE_DATABASE_ID:
-        missing_config.append("APPWRITE_DATABASE_ID")
-    if not FILE_COLLECTION_ID:
-        missing_config.append("FILE_COLLECTION_ID")
-
-    if missing_config:
-        print(f"CRITICAL CONFIG ERROR: Missing variables: {', '.join(missing_config)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Server Configuration Error: The backend is missing the following Appwrite environment IDs: {', '.join(missing_config)}. Please check your .env file or deployment setup.",
-        )
-        
+
+    # Configuration is validated once at startup (see main.py lifespan),
+    # so no per-request pre-flight check is needed here.
+    # --- Serve from Cache when Fresh ---
+    cache_key = ("list", user_id, type, after)
+    cached_response = _LIST_CACHE.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
     try:
         # --- Construct Appwrite Queries ---
+        # Project only the fields the response actually uses and cap the
+        # page size explicitly, so Appwrite doesn't ship every attribute
+        # of every document over the wire just to be discarded here.
+        # Pagination is cursor-based: offset pagination re-scans the prefix
+        # on every page, while cursor_after keeps page-N cost constant.
         queries = [
             AppwriteQuery.equal("user_id", user_id),
             AppwriteQuery.equal("type", type),
-            AppwriteQuery.order_desc("$updatedAt")
+            AppwriteQuery.order_desc("$updatedAt"),
+            AppwriteQuery.select(["name", "file_id", "$updatedAt", "$id"]),
+            AppwriteQuery.limit(LISTING_PAGE_SIZE)
         ]
+        if after:
+            queries.append(AppwriteQuery.cursor_after(after))
 
         # --- Fetch Documents from Appwrite Database ---
-        # Note: Appwrite synchronous calls must still be wrapped in run_in_threadpool if
-        # the Appwrite client is synchronous. Assuming cloud_database calls work.
-        documents = cloud_database.list_documents(
+        # The Appwrite client is synchronous, so the call is wrapped in
+        # run_in_threadpool to keep the event loop free during the round-trip.
+        documents = await run_in_threadpool(
+            cloud_database.list_documents,
             database_id=APPWRITE_DATABASE_ID,
             collection_id=FILE_COLLECTION_ID,
             queries=queries
         )
         
         # --- Process and Format Results ---
-        # We extract only the required fields: name, file_id, and updated_at
-        file_list: List[Dict[str, Any]] = []
-        for doc in documents.get('documents', []):
-            file_list.append({
+        # We extract only the required fields: name, file_id, and updated_at.
+        # Built as a single list comprehension — fewer bytecode ops per row
+        # than the equivalent append loop on large listings.
+        file_list: List[Dict[str, Any]] = [
+            {
                 "name": doc.get('name'),
                 "file_id": doc.get('file_id'),
                 "updated_at": doc.get('$updatedAt'), # Appwrite uses $updatedAt for last update time
                 "document_id": doc.get('$id')
-            })
-        
-        # --- Return Success ---
-        return {
-            "success": True, 
+            }
+            for doc in documents.get('documents', [])
+        ]
+
+        # --- Cache and Return Success ---
+        response = {
+            "success": True,
             "message": f"Successfully retrieved {len(file_list)} files of type '{type}' for user {user_id}.",
-            "files": file_list
+            "files": file_list,
+            # Pass this back as ?after=... to fetch the next page;
+            # None means this was the last page.
+            "next_cursor": file_list[-1]["document_id"] if len(file_list) == LISTING_PAGE_SIZE else None
         }
+        _LIST_CACHE[cache_key] = response
+        return response
 
     # 2. 🚨 Appwrite Exception Handling
     except AppwriteException as e:
@@ -201,143 +248,63 @@ async def files_listing_endpoint(
         )
     
 async def view_file_endpoint(
-
     file_id: str = Query(..., description="The ID of the file to view (Appwrite file_id).")
-
 ) -> StreamingResponse: # 👈 The return type is StreamingResponse
 
-   
-
-    # 1. ⚙️ Pre-Flight Configuration Check
-
-    if not APPWRITE_BUCKET_ID:
-
-        print("CRITICAL CONFIG ERROR: Missing APPWRITE_BUCKET_ID")
-
-        raise HTTPException(
-
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-
-            detail="Server Configuration Error: APPWRITE_BUCKET_ID is missing."
-
-        )
-
-       
+    # Configuration is validated once at startup (see main.py lifespan).
 
     try:
-
-        # --- Fetch the File Stream from Appwrite Storage ---
-
-        # Appwrite's get_file_view returns the file as a stream of bytes.
-
-        file_stream = cloud_storage.get_file_view(
-
-            bucket_id=APPWRITE_BUCKET_ID,
-
-            file_id=file_id
-
-        )
-
-
-
-        # NOTE: Appwrite's get_file_view often returns bytes directly.
-
-        # We need to wrap it in an IO stream for FastAPI's StreamingResponse.
-
-       
-
-        # --- Fetch File Metadata to get Content-Type ---
-
-        # The content type is crucial for the browser to display the file correctly.
-
-        file_metadata = cloud_storage.get_file(
-
-            bucket_id=APPWRITE_BUCKET_ID,
-
-            file_id=file_id
-
+        # --- Open a Streaming Request against Appwrite's View URL ---
+        # Instead of materializing the whole file in memory (the SDK's
+        # get_file_view returns one big bytes object), proxy the bytes
+        # straight through as they arrive. Memory per request stays at
+        # one 64 KiB chunk regardless of file size, and the first byte
+        # reaches the client before the download finishes server-side.
+        view_url = f"/storage/buckets/{APPWRITE_BUCKET_ID}/files/{file_id}/view"
+        upstream = await appwrite_http.send(
+            appwrite_http.build_request("GET", view_url),
+            stream=True
         )
 
-       
+        if upstream.status_code >= 400:
+            await upstream.aclose()
+            if upstream.status_code == 404:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"The requested file (ID: {file_id}) was not found in storage."
+                )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST if upstream.status_code < 500 else status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Appwrite API Call Failed. Status: {upstream.status_code}. Service: Storage."
+            )
 
-        mime_type = file_metadata.get('mimeType', 'application/octet-stream')
+        # The view response already carries the Content-Type, so no extra
+        # metadata round-trip is needed.
+        mime_type = upstream.headers.get('content-type', 'application/octet-stream')
 
-       
+        response_headers = {"Cache-Control": "public, max-age=31536000"}
+        if 'content-length' in upstream.headers:
+            response_headers["Content-Length"] = upstream.headers['content-length']
 
         # --- Return the File using StreamingResponse ---
-
-        # This streams the file directly to the client.
-
+        # We explicitly *don't* set 'Content-Disposition: attachment' to force viewing
         return StreamingResponse(
-
-            content=io.BytesIO(file_stream),
-
+            content=upstream.aiter_bytes(65536),
             media_type=mime_type, # Essential for browser viewing
-
-            # We explicitly *don't* set 'Content-Disposition: attachment' to force viewing
-
-            headers={
-
-                "Content-Length": str(len(file_stream)),
-
-                "Cache-Control": "public, max-age=31536000"
-
-            }
-
-        )
-
-
-
-    # 2. 🚨 Appwrite Exception Handling
-
-    except AppwriteException as e:
-
-        error_detail = f"Appwrite API Call Failed. Status: {e.code}. Message: {e.message}. Service: Storage."
-
-        print(f"APPWRITE FAILURE: {error_detail}")
-
-       
-
-        # Handle "File not found" specifically
-
-        if e.code == 404:
-
-             raise HTTPException(
-
-                status_code=status.HTTP_404_NOT_FOUND,
-
-                detail=f"The requested file (ID: {file_id}) was not found in storage."
-
-            )
-
-       
-
-        status_code = status.HTTP_400_BAD_REQUEST if e.code < 500 else status.HTTP_500_INTERNAL_SERVER_ERROR
-
-
-
-        raise HTTPException(
-
-            status_code=status_code,
-
-            detail=error_detail
-
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose)
         )
 
-       
+    # 2. 🚨 HTTP Exception Passthrough
+    except HTTPException:
+        raise
 
     # 3. 🛑 General Exception Handling
-
     except Exception as e:
-
         print(f"GENERAL FILE VIEW FAILURE: {type(e).__name__}: {str(e)}")
-
         raise HTTPException(
-
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-
             detail=f"An unexpected server error occurred during file viewing: {type(e).__name__} - {str(e)}"
-
         )
     
 
@@ -345,20 +312,14 @@ async def file_association_endpoint(
     source_file_id: str = Query(..., description="The Appwrite file_id of the original lesson file (the source).")
 ) -> Dict[str, Any]:
     
-    # 1. ⚙️ Pre-Flight Configuration Check
-    missing_config = []
-    if not APPWRITE_DATABASE_ID:
-        missing_config.append("APPWRITE_DATABASE_ID")
-    if not FILE_COLLECTION_ID:
-        missing_config.append("FILE_COLLECTION_ID")
-
-    if missing_config:
-        print(f"CRITICAL CONFIG ERROR: Missing variables: {', '.join(missing_config)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Server Configuration Error: Missing the following Appwrite environment IDs: {', '.join(missing_config)}."
-        )
-        
+    # Configuration is validated once at startup (see main.py lifespan),
+    # so no per-request pre-flight check is needed here.
+    # --- Serve from Cache when Fresh ---
+    cache_key = ("assoc", source_file_id)
+    cached_response = _LIST_CACHE.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
     try:
         # --- Construct Appwrite Queries ---
         # 1. Match the provided source_file_id
@@ -367,33 +328,40 @@ async def file_association_endpoint(
         queries = [
             AppwriteQuery.equal("source_file_id", source_file_id),
             AppwriteQuery.not_equal("file_id", source_file_id), # Exclude the source file itself
-            AppwriteQuery.order_desc("$updatedAt")
+            AppwriteQuery.order_desc("$updatedAt"),
+            # Only the fields the response uses, plus an explicit page cap
+            AppwriteQuery.select(["type", "name", "file_id", "$updatedAt", "$id"]),
+            AppwriteQuery.limit(100)
         ]
 
         # --- Fetch Documents from Appwrite Database ---
-        documents = cloud_database.list_documents(
+        documents = await run_in_threadpool(
+            cloud_database.list_documents,
             database_id=APPWRITE_DATABASE_ID,
             collection_id=FILE_COLLECTION_ID,
             queries=queries
         )
         
         # --- Process and Format Results ---
-        file_list: List[Dict[str, Any]] = []
-        for doc in documents.get('documents', []):
-            file_list.append({
+        file_list: List[Dict[str, Any]] = [
+            {
                 "type": doc.get('type'),
                 "name": doc.get('name'),
                 "file_id": doc.get('file_id'),
-                "updated_at": doc.get('$updatedAt'), 
+                "updated_at": doc.get('$updatedAt'),
                 "document_id": doc.get('$id')
-            })
-        
-        # --- Return Success ---
-        return {
-            "success": True, 
+            }
+            for doc in documents.get('documents', [])
+        ]
+
+        # --- Cache and Return Success ---
+        response = {
+            "success": True,
             "message": f"Successfully retrieved {len(file_list)} associated files for source ID {source_file_id}.",
             "files": file_list
         }
+        _LIST_CACHE[cache_key] = response
+        return response
 
     # 2. 🚨 Appwrite Exception Handling
     except AppwriteException as e:
@@ -426,28 +394,15 @@ async def delete_file_endpoint(
     Endpoint: /cloud/file/delete (DELETE)
     """
 
-    # 1. ⚙️ Pre-Flight Configuration Check
-    missing_config = []
-    if not APPWRITE_BUCKET_ID:
-        missing_config.append("APPWRITE_BUCKET_ID")
-    if not APPWRITE_DATABASE_ID:
-        missing_config.append("APPWRITE_DATABASE_ID")
-    if not FILE_COLLECTION_ID:
-        missing_config.append("FILE_COLLECTION_ID")
-
-    if missing_config:
-        print(f"CRITICAL CONFIG ERROR: Missing variables: {', '.join(missing_config)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Server Configuration Error: The backend is missing the following Appwrite environment IDs: {', '.join(missing_config)}. Please check your .env file or deployment setup.",
-        )
-        
+    # Configuration is validated once at startup (see main.py lifespan),
+    # so no per-request pre-flight check is needed here.
     document_id_to_delete = None
 
     try:
         # --- Step 1: Find the File Document ID in the Database ---
         # This is a security check and fetches the $id for document deletion.
-        document_list = cloud_database.list_documents(
+        document_list = await run_in_threadpool(
+            cloud_database.list_documents,
             database_id=APPWRITE_DATABASE_ID,
             collection_id=FILE_COLLECTION_ID,
             queries=[
@@ -466,13 +421,15 @@ async def delete_file_endpoint(
         document_id_to_delete = document_list['documents'][0]['$id']
 
         # --- Step 2: Delete the File from Appwrite Storage Bucket ---
-        cloud_storage.delete_file(
+        await run_in_threadpool(
+            cloud_storage.delete_file,
             bucket_id=APPWRITE_BUCKET_ID,
             file_id=file_id,
         )
-        
+
         # --- Step 3: Delete the Document from the File Listings Database ---
-        cloud_database.delete_document(
+        await run_in_threadpool(
+            cloud_database.delete_document,
             database_id=APPWRITE_DATABASE_ID,
             collection_id=FILE_COLLECTION_ID,
             document_id=document_id_to_delete,
@@ -1,112 +1,151 @@
 import os
-import tempfile
+import io
+import re
+import asyncio
+from typing import Dict, Tuple
 from fastapi import HTTPException, status, Form
-from fastapi.responses import FileResponse
-from starlette.background import BackgroundTask # Correct import for background task
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from appwrite.exception import AppwriteException
+from cachetools import LRUCache
 
-from core.cloud.appwrite import cloud_storage
-from core.converter.converters import convert_md_to_docx 
+from core.cloud.appwrite import cloud_storage, filename_cache
+from core.converter.converters import convert_md_to_docx_bytes
 
 # Configuration Constant
 APPWRITE_BUCKET_ID = os.environ.get("APPWRITE_BUCKET_ID")
 DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
-# Helper function to run cleanup in the background
-def cleanup_temp_files(path1: str, path2: str):
-    """Deletes temporary files after the response is sent."""
-    async def cleanup():
-        if os.path.exists(path1):
-            os.remove(path1)
-        if os.path.exists(path2):
-            os.remove(path2)
-    # Use BackgroundTask for Starlette/FastAPI's preferred way of handling cleanup
-    return BackgroundTask(cleanup)
+# Naming contract for the downloaded DOCX, in one compiled pattern:
+# the stored MD name looks like "(Reviewer) Source Document Name.md" and
+# the download should be "Source Document Name.docx" — strip the optional
+# "(Reviewer) " prefix and the extension in a single pass.
+_DERIVE_NAME = re.compile(r'^(?:\(Reviewer\)\s*)?(.+?)(?:\.[^.]*)?$')
 
-async def download_reviewer_docx_endpoint(
-        reviewer_file_id: str = Form(...),
-    ):
+# In-flight conversions keyed by reviewer_file_id. Concurrent requests
+# (double-clicks, refreshes) for the same file await one shared future
+# instead of each downloading and running pandoc independently.
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+# Recently converted payloads: reviewer_file_id -> (docx_bytes, filename).
+# Reviewer files are immutable once generated, so serving repeats from
+# memory is safe and skips the download + conversion entirely.
+_DOCX_CACHE: LRUCache = LRUCache(maxsize=32)
+
+
+async def _fetch_and_convert(reviewer_file_id: str) -> Tuple[bytes, str]:
     """
-    Downloads the reviewer MD file from Appwrite, converts it to DOCX, and forces download.
-    The filename is fetched from Appwrite Storage metadata.
+    Downloads the reviewer MD file from Appwrite and converts it to DOCX
+    in memory. Returns (docx_bytes, output_filename).
     """
-    
-    # Variables initialized to None for error handling/cleanup
-    temp_md_path = None
-    temp_docx_path = None
-    
+
     try:
-        # --- 1. Get File Metadata (Name) from Appwrite Storage ---
-        
-        file_metadata = cloud_storage.get_file(
-            bucket_id=APPWRITE_BUCKET_ID,
-            file_id=reviewer_file_id
-        )
-        original_file_name = file_metadata.get('name')
-        if not original_file_name:
-            raise Exception("File metadata is missing the file name.")
-
-        # --- 2. Setup Paths ---
-        
-        # Use the file ID as a unique prefix for temp files
-        unique_prefix = reviewer_file_id
-        temp_md_path = os.path.join(tempfile.gettempdir(), f"{unique_prefix}.md")
-        temp_docx_path = os.path.join(tempfile.gettempdir(), f"{unique_prefix}.docx")
-        
-        # Construct the final output filename based on the source MD file name
-        # The MD file name should look like: "(Reviewer) Source Document Name.md"
-        # We want the DOCX file to be: "Source Document Name.docx" or similar.
-        
-        # Remove the file extension (.md) and the "(Reviewer) " prefix if present.
-        base_name_no_ext = os.path.splitext(original_file_name)[0]
-        
-        output_filename = f"{base_name_no_ext}.docx"
-        
-        # --- 3. Download Reviewer MD File from Appwrite ---
-        
-        md_file_bytes = cloud_storage.get_file_download(
-            bucket_id=APPWRITE_BUCKET_ID,
-            file_id=reviewer_file_id
-        )
+        # --- 1. Get File Name and Content from Appwrite Storage ---
+
+        # The metadata call is only needed for the file name, which the
+        # generator endpoint cached at upload time. On a cache hit only the
+        # download round-trip remains; on a miss, the metadata fetch and
+        # the download run concurrently (through the threadpool, since the
+        # Appwrite SDK is synchronous) instead of paying both RTTs in series.
+        original_file_name = filename_cache.get(reviewer_file_id)
+        if original_file_name is not None:
+            md_file_bytes = await run_in_threadpool(
+                cloud_storage.get_file_download,
+                bucket_id=APPWRITE_BUCKET_ID,
+                file_id=reviewer_file_id
+            )
+        else:
+            file_metadata, md_file_bytes = await asyncio.gather(
+                run_in_threadpool(
+                    cloud_storage.get_file,
+                    bucket_id=APPWRITE_BUCKET_ID,
+                    file_id=reviewer_file_id
+                ),
+                run_in_threadpool(
+                    cloud_storage.get_file_download,
+                    bucket_id=APPWRITE_BUCKET_ID,
+                    file_id=reviewer_file_id
+                ),
+            )
+            original_file_name = file_metadata.get('name')
+            if not original_file_name:
+                raise Exception("File metadata is missing the file name.")
+            filename_cache[reviewer_file_id] = original_file_name
+
+        # --- 2. Derive the Output Filename ---
+
+        output_filename = _DERIVE_NAME.match(original_file_name).group(1) + ".docx"
+
+        # --- 3. Convert MD to DOCX Entirely In Memory ---
 
-        # Write file bytes to a temporary local MD file
-        with open(temp_md_path, "wb") as f:
-            f.write(md_file_bytes)
-
-        # --- 4. Perform the Conversion ---
-        
-        convert_md_to_docx(temp_md_path, temp_docx_path)
-
-        # --- 5. Return DOCX as a FileResponse (Force Download) ---
-        
-        return FileResponse(
-            path=temp_docx_path,
-            filename=output_filename,
-            media_type=DOCX_MIME_TYPE,
-            background=cleanup_temp_files(temp_md_path, temp_docx_path)
+        # The markdown is already in memory; the converter returns DOCX
+        # bytes directly, so no temp files (and no background cleanup
+        # race between concurrent requests) are needed on this path.
+        docx_bytes = await run_in_threadpool(
+            convert_md_to_docx_bytes,
+            md_file_bytes.decode("utf-8")
         )
 
+        return docx_bytes, output_filename
+
     except AppwriteException as e:
         # Appwrite error handling (e.g., file not found - 404)
         detail_message = f"Cloud Storage Error: {e.message}"
         if e.code == 404:
              detail_message = "Reviewer file not found in cloud storage."
 
-        if temp_md_path and os.path.exists(temp_md_path): os.remove(temp_md_path)
-        if temp_docx_path and os.path.exists(temp_docx_path): os.remove(temp_docx_path)
-        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={"success": False, "message": detail_message},
         )
-        
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         # General error handling (e.g., conversion failed)
-        
-        if temp_md_path and os.path.exists(temp_md_path): os.remove(temp_md_path)
-        if temp_docx_path and os.path.exists(temp_docx_path): os.remove(temp_docx_path)
-        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={"success": False, "message": f"Conversion failed: {str(e)}"},
-        )
\ No newline at end of file
+        )
+
+
+async def download_reviewer_docx_endpoint(
+        reviewer_file_id: str = Form(...),
+    ):
+    """
+    Downloads the reviewer MD file from Appwrite, converts it to DOCX in
+    memory, and streams the result back as a forced download.
+    Concurrent requests for the same file share a single conversion.
+    """
+
+    cached = _DOCX_CACHE.get(reviewer_file_id)
+    if cached is not None:
+        docx_bytes, output_filename = cached
+    elif (inflight := _INFLIGHT.get(reviewer_file_id)) is not None:
+        # Another request is already converting this file — wait for it.
+        docx_bytes, output_filename = await inflight
+    else:
+        future = asyncio.get_running_loop().create_future()
+        _INFLIGHT[reviewer_file_id] = future
+        try:
+            result = await _fetch_and_convert(reviewer_file_id)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved so GC doesn't warn
+            raise
+        finally:
+            del _INFLIGHT[reviewer_file_id]
+        future.set_result(result)
+        docx_bytes, output_filename = result
+        _DOCX_CACHE[reviewer_file_id] = result
+
+    # --- Stream the DOCX Back (Force Download) ---
+    return StreamingResponse(
+        content=io.BytesIO(docx_bytes),
+        media_type=DOCX_MIME_TYPE,
+        headers={
+            "Content-Disposition": f'attachment; filename="{output_filename}"',
+            "Content-Length": str(len(docx_bytes)),
+        }
+    )
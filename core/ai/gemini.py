@@ -1,31 +1,83 @@
 import os
 from google import genai
+from google.genai import types
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Model name resolved once — it never changes after process start
+_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
 
-def send_prompt(prompt: str) -> str:
+# Lazy singleton client. Creating genai.Client per call re-read the env,
+# re-validated the key, and rebuilt the underlying HTTP session, so every
+# LLM call paid a fresh TLS handshake. One shared client keeps the
+# connection to Gemini's backend warm across requests.
+_CLIENT = None
+
+
+def _get_client():
+    global _CLIENT
+    if _CLIENT is None:
+        try:
+            # You need to have the GEMINI_API_KEY environment variable set
+            _CLIENT = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+        except Exception as e:
+            error_message = f"(Gemini) Error initializing Gemini client. Error: {e}"
+            raise Exception(error_message)
+    return _CLIENT
+
+
+async def send_prompt(prompt: str, response_schema=None) -> str:
     """
     Sends a prompt to the Gemini LLM and returns the response text.
+    Async so the event loop keeps serving other requests while the
+    model is generating.
+
+    When response_schema is given (e.g. a pydantic model or list of
+    one), decoding is constrained to JSON matching that schema — the
+    model physically can't emit markdown fences or commentary, so the
+    output parses on the first try with no repair/retry pass.
     """
+    client = _get_client()
+
+    config = None
+    if response_schema is not None:
+        config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
+
     try:
-        # Initialize the LLM Client
-        # You need to have the GEMINI_API_KEY environment variable set
-        client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+        response = await client.aio.models.generate_content(
+            model=_MODEL,
+            contents=prompt,
+            config=config
+        )
+
+        return response.text
+
     except Exception as e:
-        error_message = f"(Gemini) Error initializing Gemini client. Error: {e}"
+        error_message = f"An error occurred during LLM interaction: {e}"
         raise Exception(error_message)
 
+
+async def stream_prompt(prompt: str):
+    """
+    Sends a prompt to the Gemini LLM and yields the response text in
+    chunks as the model produces them, so callers can start working on
+    early output instead of waiting for the full body.
+    """
+    client = _get_client()
+
     try:
-        response = client.models.generate_content(
-            model=os.environ.get("GEMINI_MODEL", "gemini-2.5-flash"),
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=_MODEL,
             contents=prompt
-        )
-        
-        return response.text
-        
+        ):
+            if chunk.text:
+                yield chunk.text
+
     except Exception as e:
         error_message = f"An error occurred during LLM interaction: {e}"
-        raise Exception(error_message)
\ No newline at end of file
+        raise Exception(error_message)
@@ -0,0 +1,62 @@
+import os
+from cachetools import TTLCache
+
+# Redis is optional: without it (or without REDIS_URL set) the cache is
+# purely in-process and behaves exactly like before, just without
+# surviving restarts.
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# LLM outputs are deterministic per (content, config), and re-generation
+# during debugging/testing is a large share of LLM spend — keep results
+# around for a week.
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+
+class LLMCache:
+    """
+    Two-tier async cache for LLM outputs: an in-process TTL cache in
+    front of an optional Redis backend (enabled via the REDIS_URL env
+    var). Redis lets cached generations survive process restarts and be
+    shared across workers; any Redis error degrades to the local tier
+    instead of failing the request.
+    """
+
+    def __init__(self, ttl: int = LLM_CACHE_TTL):
+        self._ttl = ttl
+        self._local: TTLCache = TTLCache(maxsize=256, ttl=ttl)
+        redis_url = os.environ.get("REDIS_URL")
+        self._redis = (
+            aioredis.from_url(redis_url, decode_responses=True)
+            if (aioredis is not None and redis_url)
+            else None
+        )
+        # Hit/miss counters, handy when judging whether the cache earns its RAM
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def get(self, key: str):
+        value = self._local.get(key)
+        if value is None and self._redis is not None:
+            try:
+                value = await self._redis.get(key)
+            except Exception as e:
+                print(f"LLM cache: Redis get failed, serving without it: {e}")
+            if value is not None:
+                # Warm the local tier so repeats skip Redis too
+                self._local[key] = value
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        self._local[key] = value
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, value, ex=self._ttl)
+            except Exception as e:
+                print(f"LLM cache: Redis set failed, kept in-process only: {e}")
+
+
+# Shared instance for the generator pipeline
+llm_cache = LLMCache()
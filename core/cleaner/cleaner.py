@@ -1,35 +1,128 @@
 import re
+import hashlib
+from cachetools import LRUCache
+from starlette.concurrency import run_in_threadpool
 from core.ai.gemini import send_prompt
 from core.prompts.prompt import read_prompt
 
+# Above this size the pre-cleaning pass is long enough to stall the
+# event loop, so it runs on the threadpool instead.
+_OFFLOAD_THRESHOLD = 256 * 1024  # 256 KiB
+
+# The cleaning instruction is static for the process lifetime, so it is
+# loaded once at import — zero filesystem touches on the request path
+# (read_prompt's own lru_cache stays as defense for dynamic callers).
+_BASE_CLEAN_PROMPT = read_prompt('clean_raw_txt')
+
+# LLM-cleaned text keyed by a content hash of the pre-cleaned input.
+# The cleaning call is the longest step of the pipeline, and the common
+# UX (generate a reviewer, then flashcards, from the same source file)
+# would otherwise pay it twice for identical input.
+_CLEAN_CACHE: LRUCache = LRUCache(maxsize=256)
+
+# One compiled alternation instead of two separate re.sub passes, so a
+# large document is scanned once instead of twice. Keeps double newlines
+# for paragraph breaks and collapses runs of spaces/tabs to one space.
+_CLEAN = re.compile(r'(?P<nl>[\r\n]{3,})|(?P<ws>[ \t]+)')
+
+
+def _clean_repl(match: re.Match) -> str:
+    return '\n\n' if match.group('nl') else ' '
+
+
+# Optional JIT-compiled byte scanner for large documents. Numba is not a
+# hard dependency — when it isn't installed (or compilation fails) the
+# regex path above handles everything. Only worth dispatching above the
+# threshold; below it the regex engine wins once JIT dispatch overhead
+# is counted.
+_NUMBA_THRESHOLD = 64 * 1024  # 64 KiB
+
+try:
+    import numpy as np
+    from numba import njit
+
+    @njit(cache=True)
+    def _clean_bytes(src, dst):
+        """
+        Single pass over a UTF-8 byte buffer: collapse runs of 3+ CR/LF
+        bytes to two '\\n', collapse runs of space/tab to one ' '.
+        Writes into dst and returns the output length.
+        """
+        n = len(src)
+        out = 0
+        i = 0
+        while i < n:
+            b = src[i]
+            if b == 0x0D or b == 0x0A:  # '\r' or '\n'
+                j = i
+                while j < n and (src[j] == 0x0D or src[j] == 0x0A):
+                    j += 1
+                if j - i >= 3:
+                    dst[out] = 0x0A
+                    dst[out + 1] = 0x0A
+                    out += 2
+                else:
+                    for k in range(i, j):
+                        dst[out] = src[k]
+                        out += 1
+                i = j
+            elif b == 0x20 or b == 0x09:  # ' ' or '\t'
+                while i < n and (src[i] == 0x20 or src[i] == 0x09):
+                    i += 1
+                dst[out] = 0x20
+                out += 1
+            else:
+                dst[out] = b
+                out += 1
+                i += 1
+        return out
+
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+
 # Basic Pre-Cleaning
 # This function is useful for general noise reduction
 def basic_text_cleaning(raw_text: str) -> str:
     """Removes excessive whitespace and common doc artifacts."""
-    if not isinstance(raw_text, str):
-        return ""
-    # Normalize line breaks and remove excessive whitespaces
-    cleaned_text = re.sub(r'[\r\n]{3,}', '\n\n', raw_text)  # Keep double newlines for paragraph breaks
-    cleaned_text = re.sub(r'[ \t]+', ' ', cleaned_text).strip()
-    return cleaned_text
+    if _HAS_NUMBA and len(raw_text) > _NUMBA_THRESHOLD:
+        # Multi-MB PDF dumps: a compiled byte walk beats the regex
+        # engine by an order of magnitude. UTF-8 continuation bytes are
+        # all >= 0x80, so the ASCII comparisons can't split a multibyte
+        # character.
+        src = np.frombuffer(raw_text.encode('utf-8'), dtype=np.uint8)
+        dst = np.empty_like(src)
+        length = _clean_bytes(src, dst)
+        return dst[:length].tobytes().decode('utf-8').strip()
+    # Normalize line breaks and remove excessive whitespaces in one pass
+    return _CLEAN.sub(_clean_repl, raw_text).strip()
 
 
 # LLM Intelligent Cleaning
-def clean_txt(raw_text: str):
+async def clean_txt(raw_text: str):
     """
     Uses an LLM to remove non-content elements (headers, footers) 
     and structure the core content (terms, lists) without summarizing.
     """
-    cleaned_input = basic_text_cleaning(raw_text)
+    # Pure-CPU work: for MB-sized documents this pass takes long enough
+    # to block every other request, so push it off the event loop.
+    if len(raw_text) > _OFFLOAD_THRESHOLD:
+        cleaned_input = await run_in_threadpool(basic_text_cleaning, raw_text)
+    else:
+        cleaned_input = basic_text_cleaning(raw_text)
 
-    # The Prompt: This is the instruction for the LLM.
-    base_prompt = read_prompt('clean_raw_txt')
+    # Same content in -> same cleaned text out, without the LLM round-trip
+    cache_key = hashlib.blake2b(cleaned_input.encode(), digest_size=16).hexdigest()
+    cached = _CLEAN_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # No indented triple-quote here — the leading spaces it adds to every
+    # line are extra tokens sent to Gemini for nothing.
+    final_prompt = f"{_BASE_CLEAN_PROMPT}\n{cleaned_input}"
 
-    final_prompt = f"""
-    {base_prompt}
-    {cleaned_input}
-    """
-    
     # Send the prompt to LLM and get the response
-    cleaned_text = send_prompt(final_prompt)
+    cleaned_text = await send_prompt(final_prompt)
+    _CLEAN_CACHE[cache_key] = cleaned_text
     return cleaned_text
\ No newline at end of file
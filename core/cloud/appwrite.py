@@ -3,25 +3,250 @@
 # ======================================
 
 import os
+import functools
+import aiofiles
+import httpx
+from cachetools import TTLCache
 from appwrite.client import Client
 from appwrite.services.storage import Storage
 from appwrite.services.databases import Databases
 from appwrite.services.account import Account
+from appwrite.exception import AppwriteException
+from appwrite.permission import Permission
+from appwrite.role import Role
 
 # --- Configuration (Load from Environment Variables) ---
 APPWRITE_ENDPOINT = os.environ.get("APPWRITE_ENDPOINT") 
 APPWRITE_PROJECT_ID = os.environ.get("APPWRITE_PROJECT_ID")
 APPWRITE_API_KEY = os.environ.get("APPWRITE_API_KEY")
 
-client = Client() 
-(client
-    .set_endpoint(APPWRITE_ENDPOINT)
-    .set_project(APPWRITE_PROJECT_ID)
-    .set_key(APPWRITE_API_KEY)
+# Memoized factories: however many import paths or reload cycles touch
+# this module, exactly one Client (and one underlying HTTP session per
+# service) exists per process, so TCP+TLS connections get reused
+# instead of rebuilt.
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> Client:
+    _client = Client()
+    (_client
+        .set_endpoint(APPWRITE_ENDPOINT)
+        .set_project(APPWRITE_PROJECT_ID)
+        .set_key(APPWRITE_API_KEY)
+    )
+    return _client
+
+
+@functools.lru_cache(maxsize=1)
+def get_storage() -> Storage:
+    return Storage(get_client())
+
+
+@functools.lru_cache(maxsize=1)
+def get_databases() -> Databases:
+    return Databases(get_client())
+
+
+@functools.lru_cache(maxsize=1)
+def get_account() -> Account:
+    return Account(get_client())
+
+
+# Module-level names kept for the existing imports across the tree
+client = get_client()
+cloud_storage = get_storage()
+cloud_database = get_databases()
+cloud_account = get_account()
+
+# --- Shared Async HTTP Client for the Appwrite REST API ---
+# Used where the synchronous SDK can't help (e.g. streaming file bytes
+# straight through to the client). One client means one reused connection
+# pool for the whole process lifetime, so calls pay a single request RTT
+# instead of a fresh TCP+TLS handshake each time. Closed from the FastAPI
+# lifespan on shutdown.
+appwrite_http = httpx.AsyncClient(
+    base_url=APPWRITE_ENDPOINT or "",
+    headers={
+        "X-Appwrite-Project": APPWRITE_PROJECT_ID or "",
+        "X-Appwrite-Key": APPWRITE_API_KEY or "",
+    },
+    timeout=httpx.Timeout(30.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
 )
 
-cloud_storage = Storage(client)
-cloud_database = Databases(client)
-cloud_account = Account(client)
+
+# Write-through cache of file_id -> file name. Every file this API ever
+# stores passes through one of our own upload paths, so endpoints that only
+# need the name (e.g. deriving a download filename) can skip a full
+# metadata round-trip to Appwrite.
+filename_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+
+# --- Thin Async Wrappers over the Appwrite REST API ---
+# Native-async equivalents of the handful of SDK calls on the hot path.
+# They go through the shared appwrite_http client, so every call reuses a
+# warm TCP+TLS connection and never needs a threadpool hop.
+
+def _raise_for_appwrite_error(response: httpx.Response):
+    """
+    Maps an Appwrite error response onto the SDK's AppwriteException so
+    the controllers' existing error handling keeps working unchanged.
+    """
+    if response.status_code >= 400:
+        try:
+            body = response.json()
+            message = body.get("message", response.text)
+            error_type = body.get("type")
+        except Exception:
+            message, error_type = response.text, None
+        raise AppwriteException(message, response.status_code, error_type, response.content)
+
+
+async def async_get_file(bucket_id: str, file_id: str) -> dict:
+    """Fetches a Storage file's metadata."""
+    response = await appwrite_http.get(f"/storage/buckets/{bucket_id}/files/{file_id}")
+    _raise_for_appwrite_error(response)
+    return response.json()
+
+
+async def async_get_file_download(bucket_id: str, file_id: str) -> bytes:
+    """Downloads a Storage file's content as bytes."""
+    response = await appwrite_http.get(f"/storage/buckets/{bucket_id}/files/{file_id}/download")
+    _raise_for_appwrite_error(response)
+    return response.content
+
+
+async def async_download_file_to_path(bucket_id: str, file_id: str, path: str):
+    """
+    Streams a Storage file's content straight to disk in 64 KiB chunks.
+
+    Unlike async_get_file_download, the whole file never sits in memory:
+    peak usage stays at one chunk regardless of file size, and the
+    network read overlaps the disk write.
+    """
+    async with appwrite_http.stream(
+        "GET", f"/storage/buckets/{bucket_id}/files/{file_id}/download"
+    ) as response:
+        if response.status_code >= 400:
+            await response.aread()
+            _raise_for_appwrite_error(response)
+        async with aiofiles.open(path, "wb") as out:
+            async for chunk in response.aiter_bytes(65536):
+                await out.write(chunk)
+
+
+async def async_create_file(bucket_id: str, file_id: str, filename: str, content: bytes, permissions: list) -> dict:
+    """Uploads in-memory bytes as a new Storage file (multipart POST)."""
+    response = await appwrite_http.post(
+        f"/storage/buckets/{bucket_id}/files",
+        # The REST API flattens array params with a [] suffix, same as the SDK
+        data={"fileId": file_id, "permissions[]": permissions},
+        files={"file": (filename, content)},
+    )
+    _raise_for_appwrite_error(response)
+    return response.json()
+
+
+async def async_create_document(database_id: str, collection_id: str, document_id: str, data: dict, permissions: list) -> dict:
+    """Creates a document in a Databases collection."""
+    response = await appwrite_http.post(
+        f"/databases/{database_id}/collections/{collection_id}/documents",
+        json={"documentId": document_id, "data": data, "permissions": permissions},
+    )
+    _raise_for_appwrite_error(response)
+    return response.json()
+
+
+def owner_permissions(user_id: str) -> list:
+    """
+    The full owner permission set granted on a user's own files.
+    Shared by the upload and generator controllers so the policy lives
+    in exactly one place.
+    """
+    return [
+        Permission.read(Role.user(user_id)),
+        Permission.write(Role.user(user_id)),
+        Permission.update(Role.user(user_id)),
+        Permission.delete(Role.user(user_id)),
+    ]
+
+
+def file_document(user_id: str, type: str, name: str, file_id: str, source_file_id: str) -> dict:
+    """
+    Builds the metadata document logged to the 'files' collection for
+    every stored file (originals, reviewers, and flashcards alike).
+    """
+    return {
+        "user_id": user_id,
+        "type": type,
+        "name": name,
+        "file_id": file_id,
+        "source_file_id": source_file_id,
+    }
+
+
+def assert_config():
+    """
+    Validates the Appwrite environment configuration once at startup.
+
+    The per-request handlers used to rebuild a missing_config list and
+    re-raise on every call even though these values never change after
+    process start. Failing fast here keeps that work out of the hot path.
+    """
+    required = {
+        "APPWRITE_ENDPOINT": APPWRITE_ENDPOINT,
+        "APPWRITE_PROJECT_ID": APPWRITE_PROJECT_ID,
+        "APPWRITE_API_KEY": APPWRITE_API_KEY,
+        "APPWRITE_BUCKET_ID": os.environ.get("APPWRITE_BUCKET_ID"),
+        "APPWRITE_DATABASE_ID": os.environ.get("APPWRITE_DATABASE_ID"),
+        "FILE_COLLECTION_ID": os.environ.get("FILE_COLLECTION_ID", "files"),
+    }
+    missing_config = [name for name, value in required.items() if not value]
+    if missing_config:
+        raise RuntimeError(
+            f"Server Configuration Error: The backend is missing the following Appwrite "
+            f"environment IDs: {', '.join(missing_config)}. Please check your .env file "
+            f"or deployment setup."
+        )
+
+
+def ensure_indexes():
+    """
+    Best-effort creation of the composite indexes the listing endpoints
+    rely on. Without them Appwrite scan-and-sorts the whole collection,
+    so listing cost grows linearly with the number of files.
+
+    Safe to call at every startup: an index that already exists comes
+    back as a 409, which is ignored.
+    """
+    database_id = os.environ.get("APPWRITE_DATABASE_ID")
+    collection_id = os.environ.get("FILE_COLLECTION_ID", "files")
+    if not database_id:
+        return
+
+    # (key, attributes, orders) matching the shapes the list queries use:
+    # two equality filters ordered by $updatedAt desc, the association
+    # lookup, and the file_id filter used by delete/not_equal.
+    wanted_indexes = [
+        ("idx_user_type_updated", ["user_id", "type", "$updatedAt"], ["ASC", "ASC", "DESC"]),
+        ("idx_source_updated", ["source_file_id", "$updatedAt"], ["ASC", "DESC"]),
+        ("idx_file_id", ["file_id"], ["ASC"]),
+    ]
+
+    for key, attributes, orders in wanted_indexes:
+        try:
+            cloud_database.create_index(
+                database_id=database_id,
+                collection_id=collection_id,
+                key=key,
+                type="key",
+                attributes=attributes,
+                orders=orders,
+            )
+            print(f"Created Appwrite index '{key}' on collection '{collection_id}'.")
+        except AppwriteException as e:
+            # 409 means the index is already there; anything else is
+            # logged but must not prevent the API from starting.
+            if e.code != 409:
+                print(f"Warning: could not ensure index '{key}': {e.message}")
 
     
\ No newline at end of file
@@ -1,52 +1,149 @@
-from pypdf import PdfReader
-from docx import Document
-from pptx import Presentation
-import pypandoc
+import os
+import io
+import mmap
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+# The converter libraries (pypdf, python-docx + lxml, python-pptx,
+# pypandoc's binary probe, PyMuPDF's native engine) are the heaviest
+# imports in the codebase, so each one is imported lazily inside the
+# function that needs it. Module import is near-free and a cold start
+# only pays for the formats a request actually touches; lru_cache makes
+# each probe a one-time cost, same as the Appwrite client factories.
+
+@lru_cache(maxsize=1)
+def _optional_pymupdf():
+    """
+    PyMuPDF extracts text through a C++ PDF engine, roughly an order of
+    magnitude faster than pypdf's pure-Python walk. pypdf stays as the
+    fallback so a missing native wheel never breaks conversions.
+    """
+    try:
+        import pymupdf
+        return pymupdf
+    except ImportError:
+        return None
+
+
+@lru_cache(maxsize=1)
+def _optional_md_parser():
+    """
+    markdown-it-py lets the MD->DOCX conversion run in-process instead
+    of forking a pandoc subprocess per download (~100-300ms of fork+
+    exec+startup before any conversion). pandoc stays as the fallback
+    for Markdown constructs the in-process builder doesn't cover.
+    """
+    try:
+        from markdown_it import MarkdownIt
+        return MarkdownIt()
+    except ImportError:
+        return None
+
+# Below this page count the serial loop wins — worker spawn and page
+# pickling cost more than the extraction itself.
+_PDF_PARALLEL_MIN_PAGES = 4
+
+# All the text converters accumulate into a list and join once at the
+# end: repeated `text += ...` reallocates and copies the whole buffer on
+# every iteration (quadratic on page/paragraph count), while a single
+# join is one allocation.
+
+def _extract_page(file_path, index: int) -> str:
+    """
+    Extracts the text of a single PDF page. Top-level (picklable) so
+    process-pool workers can run it; each worker opens its own reader
+    since pypdf objects don't cross process boundaries.
+    """
+    from pypdf import PdfReader
+    return PdfReader(file_path).pages[index].extract_text() or ""
+
 
 def convert_pdf_to_txt(file_path) -> str:
 
-    text = ""
+    parts = []
     try:
+        pymupdf = _optional_pymupdf()
+        if pymupdf is not None:
+            # Fast path: the C++ engine outruns even the parallel pypdf
+            # pool, with no worker processes to spawn.
+            with pymupdf.open(file_path) as doc:
+                return "\n".join(page.get_text() for page in doc)
+
+        from pypdf import PdfReader
         reader = PdfReader(file_path)
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
+        num_pages = len(reader.pages)
+
+        if num_pages >= _PDF_PARALLEL_MIN_PAGES:
+            # pypdf extraction is CPU-bound pure Python, so pages shard
+            # across a process pool to use every core past the GIL. The
+            # map iterator feeds the join directly — page results stream
+            # into the final buffer without a second full-size list copy.
+            with ProcessPoolExecutor() as executor:
+                return "\n".join(executor.map(
+                    partial(_extract_page, file_path),
+                    range(num_pages),
+                    chunksize=4,
+                ))
+        else:
+            # Pre-sized and index-assigned so the list never regrows
+            parts = [""] * num_pages
+            for i, page in enumerate(reader.pages):
+                parts[i] = page.extract_text() or ""
     except Exception as e:
         print(f"Error reading PDF file {file_path}: {e}")
-    return text
+    return "\n".join(parts)
 
 
 def convert_docx_to_txt(file_path) -> str:
 
-    text = ""
+    parts = []
     try:
+        from docx import Document
         doc = Document(file_path)
         for para in doc.paragraphs:
-            text += para.text + "\n"
+            parts.append(para.text)
     except Exception as e:
         print(f"Error reading DOCX file {file_path}: {e}")
-    return text
+    return "\n".join(parts)
 
 
 def convert_pptx_to_txt(file_path) -> str:
 
-    text = ""
+    parts = []
     try:
+        from pptx import Presentation
         prs = Presentation(file_path)
         for slide in prs.slides:
             for shape in slide.shapes:
                 if hasattr(shape, "text"):
-                    text += shape.text + "\n"
+                    parts.append(shape.text)
     except Exception as e:
         print(f"Error reading PPTX file {file_path}: {e}")
-    return text
+    return "\n".join(parts)
+
+
+# Above this size the file is mapped instead of read, skipping one
+# kernel-to-Python copy of the whole buffer.
+_TXT_MMAP_THRESHOLD = 1_000_000
 
 
 def convert_txt_to_txt(file_path) -> str:
 
     text = ""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            text = file.read()
+        # One-shot byte read + single decode instead of open().read(),
+        # which drips the file through Python's incremental decoder.
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size > _TXT_MMAP_THRESHOLD:
+                with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mapped:
+                    text = mapped[:].decode('utf-8', errors='replace')
+            else:
+                text = os.read(fd, size).decode('utf-8', errors='replace')
+        finally:
+            os.close(fd)
     except Exception as e:
         print(f"Error reading TXT file {file_path}: {e}")
     return text
@@ -61,6 +158,7 @@ def convert_md_to_docx(md_file_path: str, docx_output_path: str):
         docx_output_path: The path where the output DOCX file will be saved.
     """
     try:
+        import pypandoc
         pypandoc.convert_file(
             md_file_path,
             'docx',
@@ -70,5 +168,123 @@ def convert_md_to_docx(md_file_path: str, docx_output_path: str):
     except Exception as e:
         print(f"Error converting '{md_file_path}' to DOCX: {e}")
         raise e
-   
-   
\ No newline at end of file
+
+
+def _add_md_runs(paragraph, inline_token):
+    """
+    Renders an inline token's children (text, bold, italic, inline code)
+    as runs on a python-docx paragraph.
+    """
+    bold = False
+    italic = False
+    for child in inline_token.children or []:
+        if child.type == 'strong_open':
+            bold = True
+        elif child.type == 'strong_close':
+            bold = False
+        elif child.type == 'em_open':
+            italic = True
+        elif child.type == 'em_close':
+            italic = False
+        elif child.type in ('text', 'code_inline'):
+            run = paragraph.add_run(child.content)
+            run.bold = bold
+            run.italic = italic
+        elif child.type in ('softbreak', 'hardbreak'):
+            paragraph.add_run().add_break()
+        else:
+            # Unknown inline construct — let pandoc handle this document
+            raise ValueError(f"Unsupported inline markdown token: {child.type}")
+
+
+def _build_docx_from_md(md_content: str) -> bytes:
+    """
+    Builds a DOCX from the bounded Markdown subset the LLM emits
+    (headings, paragraphs, bullet/numbered lists, bold/italic) using
+    markdown-it-py + python-docx, entirely in memory. Raises ValueError
+    on constructs outside that subset so the caller can fall back.
+    """
+    from docx import Document
+    doc = Document()
+    tokens = _optional_md_parser().parse(md_content)
+    list_style = None
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.type == 'heading_open':
+            level = int(token.tag[1])
+            paragraph = doc.add_heading(level=min(level, 9))
+            _add_md_runs(paragraph, tokens[i + 1])
+            i += 3  # heading_open, inline, heading_close
+        elif token.type == 'paragraph_open':
+            paragraph = doc.add_paragraph(style=list_style)
+            _add_md_runs(paragraph, tokens[i + 1])
+            i += 3
+        elif token.type == 'bullet_list_open':
+            list_style = 'List Bullet'
+            i += 1
+        elif token.type == 'ordered_list_open':
+            list_style = 'List Number'
+            i += 1
+        elif token.type in ('bullet_list_close', 'ordered_list_close'):
+            list_style = None
+            i += 1
+        elif token.type in ('list_item_open', 'list_item_close', 'hr'):
+            i += 1
+        else:
+            raise ValueError(f"Unsupported markdown token: {token.type}")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _convert_md_to_docx_bytes_pandoc(md_content: str) -> bytes:
+    """
+    pandoc fallback. pandoc can only write binary formats to a file, so
+    a short-lived temporary file is used for the output and read back
+    immediately.
+    """
+    import pypandoc
+    tmp_output = tempfile.NamedTemporaryFile(suffix=".docx", delete=False)
+    tmp_output.close()
+    try:
+        pypandoc.convert_text(
+            md_content,
+            'docx',
+            format='md',
+            outputfile=tmp_output.name
+        )
+        with open(tmp_output.name, 'rb') as docx_file:
+            return docx_file.read()
+    finally:
+        if os.path.exists(tmp_output.name):
+            os.remove(tmp_output.name)
+
+
+def convert_md_to_docx_bytes(md_content: str) -> bytes:
+    """
+    Converts Markdown content that is already in memory to DOCX bytes.
+
+    Prefers the in-process builder (no subprocess fork, no filesystem)
+    and falls back to pandoc when markdown-it-py is unavailable or the
+    document uses constructs the builder doesn't support.
+
+    Args:
+        md_content: The Markdown source as a string.
+
+    Returns:
+        The generated DOCX file as bytes.
+    """
+    if _optional_md_parser() is not None:
+        try:
+            return _build_docx_from_md(md_content)
+        except Exception as e:
+            print(f"In-process MD->DOCX failed ({e}); falling back to pandoc.")
+
+    try:
+        return _convert_md_to_docx_bytes_pandoc(md_content)
+    except Exception as e:
+        print(f"Error converting markdown content to DOCX: {e}")
+        raise e
@@ -1,8 +1,84 @@
 import json
-from core.ai.gemini import send_prompt
+import re
+import hashlib
+import asyncio
+from typing import Dict, List, Literal, Union
+from pydantic import BaseModel, Field
+from core.ai.gemini import send_prompt, stream_prompt
+from core.cache.llm_cache import llm_cache
 from core.prompts.prompt import read_prompt
 
-def generate_reviewer(content: str) -> str:
+# Exact-hit response caching lives in llm_cache: generation is
+# deterministic enough to reuse when the same cleaned content (and, for
+# flashcards, the same count config) comes back — e.g. a re-uploaded
+# document or a retried request. A hit skips the entire multi-second LLM
+# round-trip. Keys hash the content so the cache holds two strings per
+# entry, not three copies of a large document.
+
+# In-flight generations keyed like the response cache. Concurrent
+# requests for the same content/config await one shared future instead
+# of each paying a full LLM call (same pattern as the DOCX converter).
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+
+def _content_key(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Whitespace normalization for outbound content: blank-line runs become
+# one paragraph break, space/tab runs one space. Every surviving
+# whitespace character is a billable token, and converter output can
+# still carry plenty of them even after cleaning.
+_NORMALIZE = re.compile(r"\s*\n\s*\n\s*")
+_WS = re.compile(r"[ \t]+")
+
+
+def _normalize_content(content: str) -> str:
+    return _WS.sub(" ", _NORMALIZE.sub("\n\n", content)).strip()
+
+
+# Flashcard types in required sort order, paired with their config keys.
+# Frozen at module scope so each call iterates a constant instead of
+# rebuilding a dict and a list.
+_FLASHCARD_TYPES = (
+    ("Multiple Choice", "multiplechoice"),
+    ("Identification", "identification"),
+    ("True or False", "trueorfalse"),
+    ("Enumeration", "enumeration"),
+)
+
+# Structured-output schema for a single flashcard. Passed to Gemini as
+# response_schema so decoding is constrained to this exact shape — no
+# markdown fences, no commentary, no malformed JSON to repair. Aliases
+# keep the wire keys ("Question", "Correct Answer", ...) identical to
+# what the frontend already consumes.
+class Flashcard(BaseModel):
+    question: str = Field(alias="Question")
+    # A list only for Enumeration cards; a single string otherwise
+    correct_answer: Union[str, List[str]] = Field(alias="Correct Answer")
+    # Four options for Multiple Choice, empty for every other type
+    choices: List[str] = Field(alias="Choices")
+    type: Literal[
+        "Multiple Choice", "Identification", "True or False", "Enumeration"
+    ] = Field(alias="Type")
+
+
+# Pre-warm the prompt cache at import so the first request after a cold
+# start doesn't pay the disk reads (read_prompt is lru_cached, so these
+# land in memory once and every later call is a dict hit).
+read_prompt('generate_reviewer')
+read_prompt('generate_flashcards')
+
+
+async def generate_reviewer(content: str) -> str:
+
+    # Normalized before hashing so trivially-different whitespace still
+    # lands on the same cache entry
+    content = _normalize_content(content)
+    cache_key = f"reviewer:{_content_key(content)}"
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     # The Prompt: This is the instruction for the LLM.
     base_prompt = read_prompt('generate_reviewer')
@@ -11,44 +87,65 @@ def generate_reviewer(content: str) -> str:
     {base_prompt}
     {content}
     """
-    
-    # Send the prompt to LLM and get the response
-    generated_reviewer = send_prompt(final_prompt)
+
+    # Stream the response: chunks accumulate as the model produces them
+    # (a list join builds the final string in one allocation), and the
+    # event loop yields between chunks instead of blocking until the
+    # whole reviewer is generated.
+    chunks = []
+    async for chunk in stream_prompt(final_prompt):
+        chunks.append(chunk)
+    generated_reviewer = "".join(chunks)
+    await llm_cache.set(cache_key, generated_reviewer)
     return generated_reviewer
     
 
-def generate_flashcards(content: str, config: dict) -> str:
+async def generate_flashcards(content: str, config: dict) -> str:
     """
     Generates a list of flashcards in JSON format from the provided content
     based on the specified configuration (now using quantities instead of booleans).
     The prompt is strictly set for JSON-only output.
     """
 
-    # 1. Collect required types and their counts
-    type_counts = {
-        'Multiple Choice': config.get('multiplechoice', 0),
-        'Identification': config.get('identification', 0),
-        'True or False': config.get('trueorfalse', 0),
-        'Enumeration': config.get('enumeration', 0),
-    }
-
-    # 2. Build the list of enabled types, their counts, and calculate total items
-    enabled_types_instructions = []
-    total_items = 0
-    
-    # Iterate through the desired sort order to build the instructions
-    sort_order_types = [
-        'Multiple Choice', 
-        'Identification', 
-        'True or False', 
-        'Enumeration'
-    ]
+    # Normalized before hashing so trivially-different whitespace still
+    # lands on the same cache entry
+    content = _normalize_content(content)
+    config_key = ",".join(f"{k}={v}" for k, v in sorted(config.items()))
+    cache_key = f"flashcards:{_content_key(content)}:{config_key}"
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if (inflight := _INFLIGHT.get(cache_key)) is not None:
+        # Another coroutine is already generating this exact request —
+        # wait for its result rather than issuing a duplicate LLM call.
+        return await inflight
+
+    future = asyncio.get_running_loop().create_future()
+    _INFLIGHT[cache_key] = future
+    try:
+        generated_flashcards = await _generate_flashcards(content, config)
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved so GC doesn't warn
+        raise
+    finally:
+        del _INFLIGHT[cache_key]
+    future.set_result(generated_flashcards)
+    await llm_cache.set(cache_key, generated_flashcards)
+    return generated_flashcards
 
-    for type_name in sort_order_types:
-        count = type_counts[type_name]
-        if count > 0:
-            enabled_types_instructions.append(f"{type_name} (Quantity: {count})")
-            total_items += count
+
+async def _generate_flashcards(content: str, config: dict) -> str:
+    """The actual LLM call behind generate_flashcards (uncached)."""
+
+    # 1-2. Build the list of enabled types with their counts (in the
+    # required sort order) and calculate total items
+    counts = [(name, config.get(key, 0)) for name, key in _FLASHCARD_TYPES]
+    enabled_types_instructions = [
+        f"{name} (Quantity: {count})" for name, count in counts if count > 0
+    ]
+    total_items = sum(count for _, count in counts)
 
     if total_items == 0:
         # This check is technically handled earlier in generate_flashcards_endpoint, 
@@ -62,24 +159,34 @@ def generate_flashcards(content: str, config: dict) -> str:
     base_prompt = read_prompt('generate_flashcards')
 
     # 3. Construct the Final Prompt
-    final_prompt = f"""
-    {base_prompt}
-
-    --- INSTRUCTIONS ---
-    1. The total number of flashcards to generate MUST be **{total_items}**.
-    2. The required breakdown of flashcard types and their exact quantities are:
-     * {types_quantity_list}
-    3. **SORTING REQUIREMENT**: The flashcards in the JSON array MUST be sorted by 'Type' in the following order: **Multiple Choice, Identification, True or False, Enumeration**.
-    4. **QUANTITY REQUIREMENT**: Strictly adhere to the quantity specified for each type.
-
-    --- CONTENT TO ANALYZE ---
-    ---
-    {content}
-    ---
-    """
+    # Static-prefix-first layout: everything that never changes between
+    # calls (base prompt, sorting/quantity rules) leads, and the
+    # per-request counts and document content trail. Provider prompt
+    # caching (automatic on Gemini) only matches a cached prefix, so
+    # keeping the variable parts last earns the cached-token discount
+    # and a faster time-to-first-token on repeat calls.
+    # Segments joined once (no interpolated-triple-quote temporaries)
+    # and left unindented — leading spaces are billable tokens.
+    final_prompt = "".join([
+        base_prompt,
+        "\n\n--- INSTRUCTIONS ---\n"
+        "1. **SORTING REQUIREMENT**: The flashcards in the JSON array MUST be sorted by 'Type' in the following order: **Multiple Choice, Identification, True or False, Enumeration**.\n"
+        "2. **QUANTITY REQUIREMENT**: Strictly adhere to the quantity specified for each type.\n"
+        "3. The total number of flashcards to generate MUST be **", str(total_items), "**.\n"
+        "4. The required breakdown of flashcard types and their exact quantities are:\n * ",
+        types_quantity_list,
+        "\n\n--- CONTENT TO ANALYZE ---\n---\n",
+        content,
+        "\n---\n",
+    ])
     
-    # Send the prompt to LLM and get the response (assuming send_prompt is defined elsewhere)
-    generated_flashcards = send_prompt(final_prompt)
+    # Send the prompt to LLM and get the response. The response schema
+    # guarantees a parseable JSON array of flashcards, which also let
+    # the prompt file drop its JSON-format boilerplate (fewer billable
+    # instruction tokens per call).
+    generated_flashcards = await send_prompt(
+        final_prompt, response_schema=list[Flashcard]
+    )
     return generated_flashcards
     
     
@@ -1,8 +1,13 @@
+import functools
 
+
+# Prompt templates are static files, so each one is read from disk once
+# per process and served from memory afterwards.
+@functools.lru_cache(maxsize=32)
 def read_prompt(prompt_name: str) -> str:
     """
     Reads the content of a prompt file given its name.
-    
+
     """
     prompt_path = f'core/prompts/{prompt_name}.txt'
     try:
@@ -3,29 +3,63 @@ from controllers.generate_controller import generate_reviewer_endpoint, generate
 from controllers.convert_controller import download_reviewer_docx_endpoint
 from controllers.cloud_controlller import upload_file_endpoint, files_listing_endpoint, view_file_endpoint, file_association_endpoint, delete_file_endpoint
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 
 # Import environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
+# Application lifespan: validate config once and set up Appwrite.
+# The env vars never change after process start, so checking them here
+# (instead of on every request in each handler) keeps the hot path lean.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    import anyio.to_thread
+    from core.cloud.appwrite import assert_config, ensure_indexes, appwrite_http
+    # Widen the shared threadpool (default 40 tokens) that backs
+    # run_in_threadpool: sync Appwrite SDK calls and pandoc conversions
+    # all queue here, and a burst of slow calls shouldn't stall the rest.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
+    assert_config()
+    # Make sure the composite indexes behind the listing endpoints exist.
+    # Existing indexes are a no-op.
+    ensure_indexes()
+    yield
+    # Drain the shared Appwrite connection pool on shutdown
+    await appwrite_http.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="QuickRev File API",
     description="API for file operations for QuickRev",
-    version="0.0.1"
+    version="0.0.1",
+    # orjson serializes large listing responses 3-5x faster than stdlib json
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Explicit origins instead of "*": Starlette silently drops credential
+# support under a wildcard, and a concrete list lets browsers cache the
+# preflight response instead of re-sending OPTIONS per call.
 origins = [
-    "*"
+    "https://quickrev-app.vercel.app",  # production frontend
+    "http://localhost:5173",            # local Vite dev server
 ]
 
+# Compress responses above 1 KB — listing pages are repetitive JSON
+# (repeated keys), so gzip typically shrinks them 5-10x on the wire.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True, # Allows Appwrite session cookies to be sent
-    allow_methods=["*"],    # Allow all HTTP methods (POST, GET, etc.)
-    allow_headers=["*"],    # Allow all headers
+    allow_methods=["GET", "POST", "DELETE"],         # Everything the routes actually use
+    allow_headers=["Content-Type", "X-Appwrite-Session"],
+    max_age=86400,          # Cache preflights for a day
 )
 
 # Root endpoint
@@ -52,10 +86,12 @@ async def generate_flashcards(
         file_id: str = Form(...), 
         user_id: str = Form(...),
         # REVISED: Replaced 'items: int = Form(40)' with quiz type counts (default to 10 each)
-        multiple_choice: int = Form(10),
-        identification: int = Form(10),
-        true_or_false: int = Form(10),
-        enumeration: int = Form(10),
+        # Bounds are enforced here by Pydantic (C-speed, 400s on bad input)
+        # instead of clamping by hand inside the endpoint.
+        multiple_choice: int = Form(10, ge=0, le=100),
+        identification: int = Form(10, ge=0, le=100),
+        true_or_false: int = Form(10, ge=0, le=100),
+        enumeration: int = Form(10, ge=0, le=100),
     ):
     return await generate_flashcards_endpoint(file_id, user_id, multiple_choice, identification, true_or_false, enumeration)
 
@@ -79,9 +115,10 @@ async def upload_file(
 @app.get("/cloud/file/list")
 async def files_listing(
         user_id: str = Query(..., description="The ID of the user whose files to retrieve."),
-        type: str = Query("original", description="The type of file to filter by (default: original).")
+        type: str = Query("original", description="The type of file to filter by (default: original)."),
+        after: str = Query(None, description="Cursor: document_id of the last entry from the previous page.")
     ):
-    return await files_listing_endpoint(user_id, type)
+    return await files_listing_endpoint(user_id, type, after)
 
 # View File
 @app.get("/cloud/file/view")